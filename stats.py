@@ -1,55 +1,102 @@
+import math
+
+
 class ClientStatsAccumulator():
+    # No per-instance __dict__: attribute access in the event methods is a slot lookup
+    __slots__ = ('mean_time_on_queue', 'm2_time_on_queue', 'count_time_on_queue',
+                 'mean_time_on_system', 'm2_time_on_system', 'count_time_on_system',
+                 'current_clients_on_queue', 'current_clients_on_system',
+                 'last_change', 'accum_queue', 'accum_system')
+
     def __init__(self):
-        self.time_on_queue = []
-        self.time_on_system = []
+        # Running mean and sum of squared deviations (Welford's algorithm) of the
+        # times on queue/system, instead of keeping every sample
+        self.mean_time_on_queue = 0.0
+        self.m2_time_on_queue = 0.0
+        self.count_time_on_queue = 0
+        self.mean_time_on_system = 0.0
+        self.m2_time_on_system = 0.0
+        self.count_time_on_system = 0
 
+        # Times and areas start as floats; the client counters are ints
         self.current_clients_on_queue = 0
         self.current_clients_on_system = 0
-        self.last_change_on_queue = 0
-        self.last_change_on_system = 0
-
-        self.accum_queue = 0
-        self.accum_system = 0
-
-    def add_time_on_queue(self, time):
-        self.time_on_queue.append(time)
+        # Both areas are advanced together at every event, so they share the
+        # time of the last change
+        self.last_change = 0.0
 
-    def add_time_on_system(self, time):
-        self.time_on_system.append(time)
+        self.accum_queue = 0.0
+        self.accum_system = 0.0
 
     def add_new_client(self, now):
-        self.accum_queue += self.current_clients_on_queue * (now - self.last_change_on_queue)
-        self.accum_system += self.current_clients_on_system * (now - self.last_change_on_system)
+        dt = now - self.last_change
+        self.accum_queue += self.current_clients_on_queue * dt
+        self.accum_system += self.current_clients_on_system * dt
 
-        self.last_change_on_queue = now
-        self.last_change_on_system = now
+        self.last_change = now
         self.current_clients_on_queue += 1
         self.current_clients_on_system += 1
 
-    def serve_client(self, now):
-        self.accum_queue += self.current_clients_on_queue * (now - self.last_change_on_queue)
-        self.last_change_on_queue = now
+    def serve_client(self, now, arrival_time):
+        dt = now - self.last_change
+        self.accum_queue += self.current_clients_on_queue * dt
+        self.accum_system += self.current_clients_on_system * dt
+        self.last_change = now
         self.current_clients_on_queue -= 1
 
-    def leave_system(self, now):
-        self.accum_system += self.current_clients_on_system * (now - self.last_change_on_system)
-        self.last_change_on_system = now
+        time = now - arrival_time
+        self.count_time_on_queue += 1
+        delta = time - self.mean_time_on_queue
+        self.mean_time_on_queue += delta / self.count_time_on_queue
+        self.m2_time_on_queue += delta * (time - self.mean_time_on_queue)
+
+    def leave_system(self, now, arrival_time):
+        dt = now - self.last_change
+        self.accum_queue += self.current_clients_on_queue * dt
+        self.accum_system += self.current_clients_on_system * dt
+        self.last_change = now
         self.current_clients_on_system -= 1
 
+        time = now - arrival_time
+        self.count_time_on_system += 1
+        delta = time - self.mean_time_on_system
+        self.mean_time_on_system += delta / self.count_time_on_system
+        self.m2_time_on_system += delta * (time - self.mean_time_on_system)
+
     def get_average_clients_on_queue(self, total_time):
         return self.accum_queue / total_time
 
     def get_average_clients_on_system(self, total_time):
         return self.accum_system / total_time
 
+    # With too few samples (no client for the mean, fewer than two for the
+    # variance) the statistic is undefined: report nan, not a misleading 0
     def get_average_time_on_queue(self):
-        return sum(self.time_on_queue) / len(self.time_on_queue)
+        if self.count_time_on_queue < 1:
+            return math.nan
+        return self.mean_time_on_queue
 
     def get_average_time_on_system(self):
-        return sum(self.time_on_system) / len(self.time_on_system)
+        if self.count_time_on_system < 1:
+            return math.nan
+        return self.mean_time_on_system
+
+    def get_variance_time_on_queue(self):
+        if self.count_time_on_queue < 2:
+            return math.nan
+        return self.m2_time_on_queue / (self.count_time_on_queue - 1)
+
+    def get_variance_time_on_system(self):
+        if self.count_time_on_system < 2:
+            return math.nan
+        return self.m2_time_on_system / (self.count_time_on_system - 1)
     
     def print_statistics(self, total_time):
-        print("Average number of clients on queue: {:.2f}".format(self.get_average_clients_on_queue(total_time)))
-        print("Average number of clients on system: {:.2f}".format(self.get_average_clients_on_system(total_time)))
-        print("Average time on queue: {:.2f} minutes".format(self.get_average_time_on_queue()))
-        print("Average time on system: {:.2f} minutes".format(self.get_average_time_on_system()))
\ No newline at end of file
+        avg_clients_on_queue = self.get_average_clients_on_queue(total_time)
+        avg_clients_on_system = self.get_average_clients_on_system(total_time)
+        avg_time_on_queue = self.get_average_time_on_queue()
+        avg_time_on_system = self.get_average_time_on_system()
+        print(f"Average number of clients on queue: {avg_clients_on_queue:.2f}\n"
+              f"Average number of clients on system: {avg_clients_on_system:.2f}\n"
+              f"Average time on queue: {avg_time_on_queue:.2f} minutes\n"
+              f"Average time on system: {avg_time_on_system:.2f} minutes")